@@ -1,21 +1,79 @@
-from sqlalchemy import create_engine
+import os
+
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./url_shortener.db"
+SQLALCHEMY_READ_DATABASE_URL = "sqlite:///file:./url_shortener.db?mode=ro&uri=true"
+
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA cache_size=-20000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=30000000000",
+    "PRAGMA foreign_keys=ON",
+)
 
-engine = create_engine(
+# SQLite allows a single writer at a time, so all writes go through one
+# pooled connection while reads fan out over a read-only pool.
+write_engine = create_engine(
     SQLALCHEMY_DATABASE_URL,
-    connect_args={"check_same_thread": False}
+    connect_args={"check_same_thread": False},
+    pool_size=1,
+    max_overflow=0,
+    query_cache_size=1200
+)
+
+read_engine = create_engine(
+    SQLALCHEMY_READ_DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    pool_size=os.cpu_count() or 1,
+    query_cache_size=1200
 )
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+engine = write_engine
+
+def set_sqlite_pragmas(dbapi_conn, _):
+    cursor = dbapi_conn.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
+def optimize_on_checkin(dbapi_conn, _):
+    # Invalidated connections are checked in without a DBAPI connection
+    if dbapi_conn is None:
+        return
+    cursor = dbapi_conn.cursor()
+    cursor.execute("PRAGMA optimize")
+    cursor.close()
+
+event.listen(write_engine, "connect", set_sqlite_pragmas)
+event.listen(read_engine, "connect", set_sqlite_pragmas)
+# Planner statistics live in the database file, so refreshing them through
+# the writer also benefits the read-only pool.
+event.listen(write_engine, "checkin", optimize_on_checkin)
+
+WriteSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=write_engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+SessionLocal = WriteSessionLocal
 
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
+def get_db_write():
+    db = WriteSessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+def get_db_read():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+get_db = get_db_write
@@ -1,24 +1,180 @@
 from fastapi import FastAPI, HTTPException, Depends, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import RedirectResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy import MetaData, func, select
+from sqlalchemy.exc import IntegrityError, OperationalError
 from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateTable
 from datetime import datetime
 from typing import List
-import qrcode
-from io import BytesIO
+from collections import deque, OrderedDict
+from contextlib import asynccontextmanager, suppress
+import asyncio
+import logging
+import threading
 
-from database import engine, get_db
+from database import engine, write_engine, read_engine, get_db_read, get_db_write
 from models import Base, URL, URLClick
 from schemas import URLCreate, URLResponse, URLStats, URLListResponse
-from utils import generate_short_code, is_valid_url
+from utils import generate_short_code, is_valid_url, classify_browser, render_qr_png
+
+logger = logging.getLogger(__name__)
 
 # Create database tables
 Base.metadata.create_all(bind=engine)
 
+# Earlier schemas indexed the primary keys, which SQLite already stores as
+# the rowid; the extra B-trees only slow down inserts.
+with engine.begin() as conn:
+    for index_name in ("ix_urls_id", "ix_url_clicks_id"):
+        conn.exec_driver_sql(f"DROP INDEX IF EXISTS {index_name}")
+
+# Rebuild a urls table created before it used AUTOINCREMENT. Foreign keys
+# are off for the swap so url_clicks keeps pointing at "urls".
+with engine.connect() as conn:
+    urls_sql = conn.exec_driver_sql(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'urls'"
+    ).scalar()
+    if "AUTOINCREMENT" not in urls_sql.upper():
+        columns = ", ".join(URL.__table__.columns.keys())
+        conn.exec_driver_sql("PRAGMA foreign_keys=OFF")
+        conn.execute(CreateTable(URL.__table__.to_metadata(MetaData(), name="urls_new")))
+        conn.exec_driver_sql(f"INSERT INTO urls_new ({columns}) SELECT {columns} FROM urls")
+        conn.exec_driver_sql("DROP TABLE urls")
+        conn.exec_driver_sql("ALTER TABLE urls_new RENAME TO urls")
+        conn.commit()
+        conn.exec_driver_sql("PRAGMA foreign_keys=ON")
+
+# create_all skips indexes on tables that already exist
+for table in Base.metadata.sorted_tables:
+    for index in table.indexes:
+        index.create(bind=engine, checkfirst=True)
+
+CLICK_FLUSH_INTERVAL = 0.1
+CLICK_FLUSH_BATCH_SIZE = 500
+CLICK_QUEUE_LIMIT = 100000
+
+# Clicks are recorded in memory by the redirect handler and written to the
+# database in batches, so a redirect never waits on a commit.
+click_queue: deque = deque()
+click_insert = URLClick.__table__.insert()
+
+def take_clicks(limit: int = None) -> list:
+    rows = []
+    while limit is None or len(rows) < limit:
+        try:
+            rows.append(click_queue.popleft())
+        except IndexError:
+            break
+    return rows
+
+def insert_clicks_for_existing_urls(rows: list):
+    url_ids = {row["url_id"] for row in rows}
+    with write_engine.begin() as conn:
+        existing = set(conn.execute(select(URL.id).where(URL.id.in_(url_ids))).scalars())
+        kept = [row for row in rows if row["url_id"] in existing]
+        if kept:
+            conn.execute(click_insert, kept)
+    if len(kept) < len(rows):
+        logger.warning("Dropped %d clicks for deleted URLs", len(rows) - len(kept))
+
+def flush_clicks():
+    while rows := take_clicks(CLICK_FLUSH_BATCH_SIZE):
+        try:
+            try:
+                with write_engine.begin() as conn:
+                    conn.execute(click_insert, rows)
+            except IntegrityError:
+                # A click for a URL deleted after it was queued; keep the
+                # rest of the batch and drop only the rows for missing URLs.
+                insert_clicks_for_existing_urls(rows)
+        except OperationalError:
+            # Typically a locked database; requeue and retry on the next tick
+            logger.exception("Could not write %d clicks, will retry", len(rows))
+            click_queue.extendleft(reversed(rows))
+            return
+
+def record_click(row: dict):
+    if len(click_queue) >= CLICK_QUEUE_LIMIT:
+        # The flusher is not keeping up (or not running); shed the oldest
+        # batch rather than grow without bound.
+        dropped = take_clicks(CLICK_FLUSH_BATCH_SIZE)
+        logger.warning("Click queue full, dropped %d oldest clicks", len(dropped))
+    click_queue.append(row)
+
+async def flush_clicks_periodically():
+    while True:
+        await asyncio.sleep(CLICK_FLUSH_INTERVAL)
+        try:
+            await asyncio.to_thread(flush_clicks)
+        except Exception:
+            logger.exception("Click flush failed")
+
+URL_CACHE_SIZE = 10000
+QR_CACHE_SIZE = 1024
+
+# Handlers that touch the database are plain functions run in FastAPI's
+# threadpool (redirect_to_url hands only its cache misses to it), so a wait
+# on the single write connection never blocks the event loop; the caches
+# below are shared between those threads.
+cache_lock = threading.Lock()
+
+# short_code -> (id, original_url, expires_at) for the redirect hot path.
+# Entries are dropped when the URL is deleted or found to be expired.
+url_cache: OrderedDict = OrderedDict()
+
+# Bumped by every delete; a lookup that straddles one does not cache its
+# result, since it may have read the row before the delete committed.
+cache_generation = [0]
+
+# short_code -> rendered PNG; the image only depends on the short URL.
+qr_cache: OrderedDict = OrderedDict()
+
+def cached_short_code(short_code: str):
+    with cache_lock:
+        cached = url_cache.get(short_code)
+        if cached is not None:
+            url_cache.move_to_end(short_code)
+        return cached
+
+def load_short_code(short_code: str):
+    with cache_lock:
+        generation = cache_generation[0]
+    
+    with read_engine.connect() as conn:
+        row = conn.execute(
+            select(URL.id, URL.original_url, URL.expires_at)
+            .where(URL.short_code == short_code)
+        ).first()
+    if not row:
+        return None
+    
+    loaded = tuple(row)
+    with cache_lock:
+        if cache_generation[0] != generation:
+            return loaded
+        url_cache[short_code] = loaded
+        if len(url_cache) > URL_CACHE_SIZE:
+            url_cache.popitem(last=False)
+    return loaded
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    with write_engine.begin() as conn:
+        conn.exec_driver_sql("ANALYZE")
+    flusher = asyncio.create_task(flush_clicks_periodically())
+    yield
+    flusher.cancel()
+    with suppress(asyncio.CancelledError):
+        await flusher
+    flush_clicks()
+
 app = FastAPI(
     title="URL Shortener API",
     description="A professional URL shortening service with analytics and QR codes",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configure CORS
@@ -45,29 +201,29 @@ async def root():
     }
 
 @app.post("/shorten", response_model=URLResponse, tags=["URLs"])
-async def shorten_url(url_data: URLCreate, db: Session = Depends(get_db)):
+def shorten_url(url_data: URLCreate, db: Session = Depends(get_db_write)):
     if not is_valid_url(url_data.original_url):
         raise HTTPException(status_code=400, detail="Invalid URL format")
     
-    if url_data.custom_alias:
-        existing = db.query(URL).filter(URL.short_code == url_data.custom_alias).first()
-        if existing:
-            raise HTTPException(status_code=400, detail="Custom alias already exists")
-        short_code = url_data.custom_alias
-    else:
-        while True:
+    short_code = url_data.custom_alias or generate_short_code()
+    
+    # The unique index on short_code detects collisions, so the happy path
+    # is a single INSERT with no lookup beforehand.
+    while True:
+        db_url = URL(
+            original_url=url_data.original_url,
+            short_code=short_code,
+            expires_at=url_data.expires_at
+        )
+        db.add(db_url)
+        try:
+            db.commit()
+            break
+        except IntegrityError:
+            db.rollback()
+            if url_data.custom_alias:
+                raise HTTPException(status_code=400, detail="Custom alias already exists")
             short_code = generate_short_code()
-            existing = db.query(URL).filter(URL.short_code == short_code).first()
-            if not existing:
-                break
-    
-    db_url = URL(
-        original_url=url_data.original_url,
-        short_code=short_code,
-        expires_at=url_data.expires_at
-    )
-    db.add(db_url)
-    db.commit()
     db.refresh(db_url)
     
     return URLResponse(
@@ -81,66 +237,79 @@ async def shorten_url(url_data: URLCreate, db: Session = Depends(get_db)):
     )
 
 @app.get("/{short_code}", tags=["URLs"])
-async def redirect_to_url(
-    short_code: str,
-    request: Request,
-    db: Session = Depends(get_db)
-):
-    url = db.query(URL).filter(URL.short_code == short_code).first()
+async def redirect_to_url(short_code: str, request: Request):
+    # Cache hits are served on the event loop; only a miss goes to the
+    # threadpool for the database lookup.
+    resolved = cached_short_code(short_code)
+    if resolved is None:
+        resolved = await run_in_threadpool(load_short_code, short_code)
     
-    if not url:
+    if not resolved:
         raise HTTPException(status_code=404, detail="Short URL not found")
     
-    if url.expires_at and url.expires_at < datetime.utcnow():
+    url_id, original_url, expires_at = resolved
+    
+    if expires_at and expires_at < datetime.utcnow():
+        with cache_lock:
+            url_cache.pop(short_code, None)
         raise HTTPException(status_code=410, detail="This short URL has expired")
     
-    click = URLClick(
-        url_id=url.id,
-        referrer=request.headers.get("referer"),
-        user_agent=request.headers.get("user-agent"),
-        ip_address=request.client.host if request.client else None
-    )
-    db.add(click)
-    db.commit()
+    record_click({
+        "url_id": url_id,
+        "clicked_at": datetime.utcnow(),
+        "referrer": request.headers.get("referer"),
+        "user_agent": request.headers.get("user-agent"),
+        "ip_address": request.client.host if request.client else None
+    })
     
-    return RedirectResponse(url=url.original_url, status_code=307)
+    return RedirectResponse(url=original_url, status_code=307)
 
 @app.get("/stats/{short_code}", response_model=URLStats, tags=["Analytics"])
-async def get_url_stats(short_code: str, db: Session = Depends(get_db)):
+def get_url_stats(short_code: str, db: Session = Depends(get_db_read)):
     url = db.query(URL).filter(URL.short_code == short_code).first()
     
     if not url:
         raise HTTPException(status_code=404, detail="Short URL not found")
     
-    clicks = db.query(URLClick).filter(URLClick.url_id == url.id).all()
+    click_count = db.query(func.count(URLClick.id)).filter(URLClick.url_id == url.id).scalar()
+    
+    referrer_label = func.coalesce(func.nullif(URLClick.referrer, ""), "Direct")
+    referrers = dict(
+        db.query(referrer_label, func.count(URLClick.id))
+        .filter(URLClick.url_id == url.id)
+        .group_by(referrer_label)
+        .all()
+    )
+    
+    # Most clicks share a handful of user agents, so classify each distinct
+    # string once and weight it by its count.
+    agent_counts = (
+        db.query(URLClick.user_agent, func.count(URLClick.id))
+        .filter(URLClick.url_id == url.id)
+        .group_by(URLClick.user_agent)
+        .all()
+    )
     
-    referrers = {}
     user_agents = {}
-    recent_clicks = []
-    
-    for click in clicks:
-        ref = click.referrer or "Direct"
-        referrers[ref] = referrers.get(ref, 0) + 1
-        
-        ua = click.user_agent or "Unknown"
-        if "Chrome" in ua:
-            browser = "Chrome"
-        elif "Firefox" in ua:
-            browser = "Firefox"
-        elif "Safari" in ua:
-            browser = "Safari"
-        elif "Edge" in ua:
-            browser = "Edge"
-        else:
-            browser = "Other"
-        user_agents[browser] = user_agents.get(browser, 0) + 1
-        
-        if len(recent_clicks) < 10:
-            recent_clicks.append({
-                "timestamp": click.clicked_at,
-                "referrer": click.referrer,
-                "user_agent": click.user_agent
-            })
+    for user_agent, count in agent_counts:
+        browser = classify_browser(user_agent)
+        user_agents[browser] = user_agents.get(browser, 0) + count
+    
+    recent = (
+        db.query(URLClick.clicked_at, URLClick.referrer, URLClick.user_agent)
+        .filter(URLClick.url_id == url.id)
+        .order_by(URLClick.clicked_at.desc())
+        .limit(10)
+        .all()
+    )
+    recent_clicks = [
+        {
+            "timestamp": clicked_at,
+            "referrer": referrer,
+            "user_agent": user_agent
+        }
+        for clicked_at, referrer, user_agent in recent
+    ]
     
     return URLStats(
         id=url.id,
@@ -149,65 +318,85 @@ async def get_url_stats(short_code: str, db: Session = Depends(get_db)):
         short_url=f"http://localhost:8000/{url.short_code}",
         created_at=url.created_at,
         expires_at=url.expires_at,
-        click_count=len(clicks),
+        click_count=click_count,
         referrers=referrers,
         user_agents=user_agents,
         recent_clicks=recent_clicks
     )
 
 @app.get("/qr/{short_code}", tags=["QR Codes"])
-async def generate_qr_code(short_code: str, db: Session = Depends(get_db)):
+def generate_qr_code(short_code: str, db: Session = Depends(get_db_read)):
     url = db.query(URL).filter(URL.short_code == short_code).first()
     
     if not url:
         raise HTTPException(status_code=404, detail="Short URL not found")
     
-    qr = qrcode.QRCode(version=1, box_size=10, border=5)
-    qr.add_data(f"http://localhost:8000/{short_code}")
-    qr.make(fit=True)
+    with cache_lock:
+        png = qr_cache.get(short_code)
+        if png is not None:
+            qr_cache.move_to_end(short_code)
+            return Response(content=png, media_type="image/png")
     
-    img = qr.make_image(fill_color="black", back_color="white")
+    png = render_qr_png(f"http://localhost:8000/{short_code}")
+    with cache_lock:
+        qr_cache[short_code] = png
+        if len(qr_cache) > QR_CACHE_SIZE:
+            qr_cache.popitem(last=False)
     
-    buf = BytesIO()
-    img.save(buf, format='PNG')
-    buf.seek(0)
-    
-    return Response(content=buf.getvalue(), media_type="image/png")
+    return Response(content=png, media_type="image/png")
 
 @app.get("/urls", response_model=List[URLListResponse], tags=["URLs"])
-async def list_urls(
+def list_urls(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db_read)
 ):
-    urls = db.query(URL).offset(skip).limit(limit).all()
-    
-    result = []
-    for url in urls:
-        click_count = db.query(URLClick).filter(URLClick.url_id == url.id).count()
-        result.append(URLListResponse(
-            id=url.id,
-            original_url=url.original_url,
-            short_code=url.short_code,
-            short_url=f"http://localhost:8000/{url.short_code}",
-            created_at=url.created_at,
-            expires_at=url.expires_at,
-            click_count=click_count
-        ))
-    
-    return result
+    rows = (
+        db.query(URL, func.count(URLClick.id))
+        .outerjoin(URLClick)
+        .group_by(URL.id)
+        .offset(skip)
+        .limit(limit)
+        .all()
+    )
+    
+    # Plain dicts are validated once, in bulk, by the List[URLListResponse]
+    # response model rather than constructing a model per row here.
+    return [
+        {
+            "id": url.id,
+            "original_url": url.original_url,
+            "short_code": url.short_code,
+            "short_url": f"http://localhost:8000/{url.short_code}",
+            "created_at": url.created_at,
+            "expires_at": url.expires_at,
+            "click_count": click_count
+        }
+        for url, click_count in rows
+    ]
 
 @app.delete("/urls/{short_code}", tags=["URLs"])
-async def delete_url(short_code: str, db: Session = Depends(get_db)):
+def delete_url(short_code: str, db: Session = Depends(get_db_write)):
     url = db.query(URL).filter(URL.short_code == short_code).first()
     
     if not url:
         raise HTTPException(status_code=404, detail="Short URL not found")
     
-    db.query(URLClick).filter(URLClick.url_id == url.id).delete()
+    url_id = url.id
+    db.query(URLClick).filter(URLClick.url_id == url_id).delete()
     db.delete(url)
     db.commit()
     
+    # Evict only once the delete is visible, so no new lookup can re-cache it
+    with cache_lock:
+        cache_generation[0] += 1
+        url_cache.pop(short_code, None)
+        qr_cache.pop(short_code, None)
+    # Drop pending clicks for this URL so the flusher never inserts rows
+    # referencing it; everything else goes back on the queue.
+    pending = [row for row in take_clicks() if row["url_id"] != url_id]
+    click_queue.extendleft(reversed(pending))
+    
     return {"message": "URL deleted successfully"}
 
 @app.get("/health", tags=["Health"])
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from database import Base
@@ -6,7 +6,7 @@ from database import Base
 class URL(Base):
     __tablename__ = "urls"
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     original_url = Column(String, nullable=False, index=True)
     short_code = Column(String, unique=True, nullable=False, index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -14,13 +14,17 @@ class URL(Base):
     
     clicks = relationship("URLClick", back_populates="url", cascade="all, delete-orphan")
     
+    # Never reuse the id of a deleted URL: cached redirects and queued
+    # clicks refer to URLs by id.
+    __table_args__ = {"sqlite_autoincrement": True}
+    
     def __repr__(self):
         return f"<URL {self.short_code} -> {self.original_url}>"
 
 class URLClick(Base):
     __tablename__ = "url_clicks"
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     url_id = Column(Integer, ForeignKey("urls.id"), nullable=False)
     clicked_at = Column(DateTime, default=datetime.utcnow)
     referrer = Column(String, nullable=True)
@@ -29,5 +33,9 @@ class URLClick(Base):
     
     url = relationship("URL", back_populates="clicks")
     
+    __table_args__ = (
+        Index("ix_url_clicks_url_clicked", "url_id", "clicked_at"),
+    )
+    
     def __repr__(self):
         return f"<URLClick {self.id} for URL {self.url_id}>"
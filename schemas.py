@@ -28,29 +28,11 @@ class URLResponse(BaseModel):
     class Config:
         from_attributes = True
 
-class URLListResponse(BaseModel):
-    id: int
-    original_url: str
-    short_code: str
-    short_url: str
-    created_at: datetime
-    expires_at: Optional[datetime]
-    click_count: int
-    
-    class Config:
-        from_attributes = True
+# /urls returns the same shape as /shorten; one model avoids building a
+# second identical Pydantic schema at startup.
+URLListResponse = URLResponse
 
-class URLStats(BaseModel):
-    id: int
-    original_url: str
-    short_code: str
-    short_url: str
-    created_at: datetime
-    expires_at: Optional[datetime]
-    click_count: int
+class URLStats(URLResponse):
     referrers: Dict[str, int]
     user_agents: Dict[str, int]
     recent_clicks: List[Dict]
-    
-    class Config:
-        from_attributes = True
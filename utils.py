@@ -1,18 +1,42 @@
-import random
-import string
 import re
+import secrets
+from io import BytesIO
+from urllib.parse import urlparse
+
+import segno
 
 def generate_short_code(length: int = 6) -> str:
-    characters = string.ascii_letters + string.digits
-    return ''.join(random.choice(characters) for _ in range(length))
+    return secrets.token_urlsafe(length)[:length]
+
+BROWSERS = ("Chrome", "Firefox", "Safari", "Edge")
+BROWSER_PATTERN = re.compile("|".join(BROWSERS))
+
+def classify_browser(user_agent: str) -> str:
+    # Chrome and Edge user agents also mention Safari, so the first browser
+    # in BROWSERS that appears anywhere in the string wins.
+    found = set(BROWSER_PATTERN.findall(user_agent or ""))
+    return next((browser for browser in BROWSERS if browser in found), "Other")
+
+VALID_SCHEMES = {"http", "https"}
 
 def is_valid_url(url: str) -> bool:
-    url_pattern = re.compile(
-        r'^https?://'
-        r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?.)+[A-Z]{2,6}.?|'
-        r'localhost|'
-        r'd{1,3}.d{1,3}.d{1,3}.d{1,3})'
-        r'(?::d+)?'
-        r'(?:/?|[/?]S+)$', re.IGNORECASE)
+    # urlparse silently strips tabs and newlines, so check the raw string
+    if any(char.isspace() for char in url):
+        return False
+    
+    try:
+        parsed = urlparse(url)
+        hostname = parsed.hostname
+        # Raises for a non-numeric or out-of-range port
+        parsed.port
+    except ValueError:
+        # e.g. an unterminated IPv6 literal such as "http://[::1"
+        return False
     
-    return url_pattern.match(url) is not None
+    return parsed.scheme in VALID_SCHEMES and bool(hostname)
+
+def render_qr_png(data: str) -> bytes:
+    qr = segno.make_qr(data, error="m", boost_error=False)
+    buf = BytesIO()
+    qr.save(buf, kind="png", scale=10, border=5)
+    return buf.getvalue()